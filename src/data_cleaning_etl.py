@@ -1,68 +1,107 @@
-import pandas as pd
+import polars as pl
 import os
 
 
 RAW_DATA_PATH = r'D:\DS\DS25\GreenFin\GreenFin-AI\data\raw'
 CLEANED_DATA_PATH = r'D:\DS\DS25\GreenFin\GreenFin-AI\data\cleaned'
-CLEANED_FILE = os.path.join(CLEANED_DATA_PATH, 'portfolio_clean.csv')
+CLEANED_FILE = os.path.join(CLEANED_DATA_PATH, 'portfolio_clean.parquet')
 
 # 1 Ensure the output directory exists
 os.makedirs(CLEANED_DATA_PATH, exist_ok=True)
 os.makedirs('src', exist_ok=True)
 
+# Column types for the raw extracts, so the CSV reader does not have to infer them
+RAW_COLUMN_TYPES = {
+    'loan_portfolio.csv': {
+        'Loan_ID': pl.Utf8, 'Borrower_Name': pl.Utf8, 'Sector': pl.Utf8,
+        'Outstanding_Amount_Mn': pl.Float64,
+    },
+    'company_financials.csv': {
+        'Borrower_Name': pl.Utf8, 'Revenue_Mn': pl.Float64,
+        'Enterprise_Value_Mn': pl.Float64, 'Reported_GHG_Emissions_tCO2e': pl.Float64,
+    },
+    'esg_scores.csv': {
+        'Borrower_Name': pl.Utf8, 'ESG_Score_0_100': pl.Float32, 'Governance_Risk_1_5': pl.Int8,
+    },
+    'emission_factors.csv': {
+        'Sector': pl.Utf8, 'Emissions_Intensity_tCO2e_per_M_Rev': pl.Float32,
+    },
+}
+
+# Narrow types stored in the cleaned Parquet file, so the analysis loaders read
+# compact columns (and a dictionary-encoded Sector) without any conversion
+CLEANED_COLUMN_TYPES = {
+    'Sector': pl.Categorical,
+    'ESG_Score_0_100': pl.Float32,
+    'Governance_Risk_1_5': pl.Int8,
+    'Emissions_Intensity_tCO2e_per_M_Rev': pl.Float32,
+}
+
+# Continuous columns imputed with their median after the merge
+MEDIAN_IMPUTED_COLUMNS = ['Outstanding_Amount_Mn', 'Revenue_Mn', 'Enterprise_Value_Mn', 'ESG_Score_0_100']
+
+def scan_raw_csv(filename):
+    """
+    Lazily scans a raw extract with Polars. Nothing is read until the pipeline
+    is collected, so only the columns the ETL actually uses are parsed.
+    """
+    return pl.scan_csv(
+        os.path.join(RAW_DATA_PATH, filename),
+        schema_overrides=RAW_COLUMN_TYPES[filename],
+    )
+
 def execute_etl():
     """
     Performs the core ETL (cleaning, merging, imputation) to create the
     portfolio_clean dataset for modeling. This simulates the Redshift/Glue job.
+    The whole job is built as a single Polars lazy query and collected once.
     """
     print("--- Starting GreenFin AI Data Cleaning and ETL (Phase 1.4) ---")
     
     try:
         # 1. Loading Raw Data
-        loan_df = pd.read_csv(os.path.join(RAW_DATA_PATH, 'loan_portfolio.csv'))
-        financials_df = pd.read_csv(os.path.join(RAW_DATA_PATH, 'company_financials.csv'))
-        esg_df = pd.read_csv(os.path.join(RAW_DATA_PATH, 'esg_scores.csv'))
-        factors_df = pd.read_csv(os.path.join(RAW_DATA_PATH, 'emission_factors.csv'))
+        loans = scan_raw_csv('loan_portfolio.csv')
+        financials = scan_raw_csv('company_financials.csv')
+        esg = scan_raw_csv('esg_scores.csv')
+        factors = scan_raw_csv('emission_factors.csv')
         
-        print("1. Raw data loaded successfully.")
+        print("1. Raw data sources registered.")
         
         # 2. Mergeing the  Data Sources (Simulating complex joins in Redshift)
-        
-        # Merge 1: Loan Portfolio and Financials (on Borrower Name)
-        portfolio_clean = pd.merge(loan_df, financials_df, on='Borrower_Name', how='left')
-        
-        # Merge 2: Add ESG Scores
-        portfolio_clean = pd.merge(portfolio_clean, esg_df, on='Borrower_Name', how='left')
-
-        # Merge 3: Add Sector Emission Factors (Crucial for baseline PCAF calculation)
-        portfolio_clean = pd.merge(portfolio_clean, factors_df, on='Sector', how='left')
+        portfolio_clean = (
+            loans
+            # Merge 1: Loan Portfolio and Financials (on Borrower Name)
+            .join(financials, on='Borrower_Name', how='left')
+            # Merge 2: Add ESG Scores
+            .join(esg, on='Borrower_Name', how='left')
+            # Merge 3: Add Sector Emission Factors (Crucial for baseline PCAF calculation)
+            .join(factors, on='Sector', how='left')
+        )
 
         print("2. All data sources merged into a single portfolio dataframe.Take a Look at the Data")
 
         # 3. Data Cleaning and Transformation
-        
-        # Imputation: Replace missing Reported_GHG_Emissions_tCO2e with a flag value (0)
-        # We will use the model to predict these later, but for initial clean, NaN must be handled.
-        # Create a flag before imputation
-        portfolio_clean['Reported_Missing_Flag'] = portfolio_clean['Reported_GHG_Emissions_tCO2e'].isnull().astype(int)
-        
         # Impute NaNs in the emissions column with 0 for now (to avoid breaking models)
-        portfolio_clean['Reported_GHG_Emissions_tCO2e'] = portfolio_clean['Reported_GHG_Emissions_tCO2e'].fillna(0)
-        
+        emissions = pl.col('Reported_GHG_Emissions_tCO2e').fill_null(0)
         # Handle potential NaNs from missing ESG/Financials (shouldn't happen with synthetic data, but good practice)
-        for col in ['Outstanding_Amount_Mn', 'Revenue_Mn', 'Enterprise_Value_Mn', 'ESG_Score_0_100']:
-             # Use median imputation for continuous variables
-            portfolio_clean[col] = portfolio_clean[col].fillna(portfolio_clean[col].median())
-        
-        # Feature Engineering (Basic Ratios - useful for credit risk and emissions proxies)
-        portfolio_clean['Debt_to_EV_Ratio'] = portfolio_clean['Outstanding_Amount_Mn'] / portfolio_clean['Enterprise_Value_Mn']
-        portfolio_clean['Emissions_per_Revenue'] = portfolio_clean['Reported_GHG_Emissions_tCO2e'] / portfolio_clean['Revenue_Mn']
-        
-        print("3. Data cleaning, imputation, and initial feature engineering completed.")
+        # Use median imputation for continuous variables
+        imputed = {col: pl.col(col).fill_null(pl.col(col).median()) for col in MEDIAN_IMPUTED_COLUMNS}
 
-        # 4. Final Output (Simulating writing to the Redshift Cleaned DW)
-        portfolio_clean = portfolio_clean.sort_values(by='Borrower_Name').reset_index(drop=True)
+        # All cleaned and derived columns are added in a single projection; the ratios reuse the
+        # imputed expressions (Polars evaluates each shared expression once).
+        portfolio_clean = portfolio_clean.with_columns(
+            # Imputation: Replace missing Reported_GHG_Emissions_tCO2e with a flag value (0)
+            # We will use the model to predict these later, but for initial clean, NaN must be handled.
+            # Create a flag before imputation
+            pl.col('Reported_GHG_Emissions_tCO2e').is_null().cast(pl.Int8).alias('Reported_Missing_Flag'),
+            emissions,
+            *imputed.values(),
+            # Feature Engineering (Basic Ratios - useful for credit risk and emissions proxies)
+            (imputed['Outstanding_Amount_Mn'] / imputed['Enterprise_Value_Mn']).alias('Debt_to_EV_Ratio'),
+            (emissions / imputed['Revenue_Mn']).alias('Emissions_per_Revenue'),
+        )
         
+        # 4. Final Output (Simulating writing to the Redshift Cleaned DW)
         # Select final columns to match the planned Redshift schema structure
         final_columns = [
             'Loan_ID', 'Borrower_Name', 'Sector', 'Outstanding_Amount_Mn', 
@@ -71,8 +110,23 @@ def execute_etl():
             'Emissions_Intensity_tCO2e_per_M_Rev', 'Debt_to_EV_Ratio'
         ]
         
-        # Save the cleaned portfolio to a new CSV file
-        portfolio_clean[final_columns].to_csv(CLEANED_FILE, index=False)
+        portfolio_clean = (
+            portfolio_clean
+            .select(final_columns)
+            .cast(CLEANED_COLUMN_TYPES)
+            .collect()
+        )
+
+        print("3. Data cleaning, imputation, and initial feature engineering completed.")
+
+        # Confirm the narrow types the loaders rely on before anything is written
+        wrong_types = {col: portfolio_clean.schema.get(col) for col, dtype in CLEANED_COLUMN_TYPES.items()
+                       if portfolio_clean.schema.get(col) != dtype}
+        if wrong_types:
+            raise ValueError(f"Cleaned portfolio has unexpected column types: {wrong_types}")
+
+        # Save the cleaned portfolio as ZSTD-compressed Parquet (typed, columnar)
+        portfolio_clean.write_parquet(CLEANED_FILE, compression='zstd')
         
         print(f"4. Cleaned portfolio saved to: {CLEANED_FILE}")
         print(f"Final Cleaned Records: {len(portfolio_clean)}.")
@@ -87,4 +141,4 @@ def execute_etl():
 if __name__ == '__main__':
     execute_etl()
     print("\n--- Stage 1 (Data Engineering) ETL Complete. ---")
-    print("The 'portfolio_clean.csv' is now ready for Stage 2: Modeling and Analytics.")
\ No newline at end of file
+    print("The 'portfolio_clean.parquet' is now ready for Stage 2: Modeling and Analytics.")
\ No newline at end of file
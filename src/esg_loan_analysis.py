@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import pyarrow.parquet as pq
+import argparse
 import sys
 import os # Import the os module for file operations
 
@@ -39,19 +40,21 @@ def save_report_content(filename, content):
 def load_data(filepath):
     """Loads the ESG loan data."""
     try:
-        # Load the data
-        df = pd.read_csv(filepath)
-        
-        # Ensure all required columns for analysis are present
+        # Ensure all required columns for analysis are present (checked against the Parquet schema)
         required_cols = list(ESG_SCORING_WEIGHTS.keys()) + ['Outstanding_Amount_Mn', 'Sector', 'Borrower_Name', 'Loan_ID']
-        if not all(col in df.columns for col in required_cols):
-            missing = [col for col in required_cols if col not in df.columns]
-            print(f"Error: Missing required columns for analysis: {missing}. Found columns: {df.columns.tolist()}")
+        available_cols = pq.read_schema(filepath).names
+        if not all(col in available_cols for col in required_cols):
+            missing = [col for col in required_cols if col not in available_cols]
+            print(f"Error: Missing required columns for analysis: {missing}. Found columns: {available_cols}")
             sys.exit(1)
 
+        # Load only the columns used by the analysis; the cleaned file already stores
+        # scores as float32/int8 and Sector as a category, so no dtype conversion is needed
+        df = pd.read_parquet(filepath, columns=required_cols, engine='pyarrow')
+
         # Handle missing ESG/Emissions data by filling with a median or neutral value
-        for col in ESG_SCORING_WEIGHTS.keys():
-            df[col].fillna(df[col].median(), inplace=True)
+        score_cols = list(ESG_SCORING_WEIGHTS.keys())
+        df[score_cols] = df[score_cols].fillna(df[score_cols].median())
             
         # Drop rows where critical financial data is missing
         df.dropna(subset=['Outstanding_Amount_Mn', 'Sector'], inplace=True)
@@ -70,62 +73,61 @@ def calculate_green_finance_score(df):
     """
     Calculates a single Green Finance Score (0-100) for each loan by normalizing and weighting ESG metrics.
     A higher score indicates better green alignment/lower risk.
+    The score is added to `df` in place (no copy of the frame) and `df` is returned sorted by it.
     """
-    df_scores = df.copy()
+    esg = df['ESG_Score_0_100'].to_numpy(dtype=np.float64)
+    gov = df['Governance_Risk_1_5'].to_numpy(dtype=np.float64)
+    emissions = df['Emissions_Intensity_tCO2e_per_M_Rev'].to_numpy(dtype=np.float64)
 
     # 1. Normalize ESG_Score (Higher is better, score 0-100)
-    df_scores['Normalized_ESG'] = df_scores['ESG_Score_0_100'] / 100.0
+    normalized_esg = esg / 100.0
 
     # 2. Normalize Governance Risk (Lower is better, score 1-5)
     # Inverse scaling: A score of 1 (Min Risk) -> 1.0 (Good). A score of 5 (Max Risk) -> 0.0 (Bad).
-    df_scores['Normalized_Gov'] = (5 - df_scores['Governance_Risk_1_5']) / 4.0
+    normalized_gov = (5 - gov) / 4.0
 
     # 3. Normalize Emissions Intensity (Lower is better) - Rank-based approach
     
     # Clip extreme outliers to prevent distortion during ranking
-    emission_limit = df_scores['Emissions_Intensity_tCO2e_per_M_Rev'].quantile(0.95)
-    df_scores['Emissions_Capped'] = df_scores['Emissions_Intensity_tCO2e_per_M_Rev'].clip(upper=emission_limit)
+    emissions_capped = np.minimum(emissions, np.quantile(emissions, 0.95))
 
     # Rank the capped emissions, then normalize to 0-1 and invert (1 - score)
-    df_scores['Normalized_Emission'] = 1 - df_scores['Emissions_Capped'].rank(pct=True)
+    normalized_emission = 1 - pd.Series(emissions_capped).rank(pct=True).to_numpy()
 
-    # 4. Apply Weights to calculate the Final Score (0 to 1)
-    df_scores['Green_Finance_Score'] = (
-        df_scores['Normalized_ESG'] * ESG_SCORING_WEIGHTS['ESG_Score_0_100'] +
-        df_scores['Normalized_Gov'] * ESG_SCORING_WEIGHTS['Governance_Risk_1_5'] +
-        df_scores['Normalized_Emission'] * ESG_SCORING_WEIGHTS['Emissions_Intensity_tCO2e_per_M_Rev']
-    )
-    
-    # Scale to 0-100 for readability
-    df_scores['Green_Finance_Score'] *= 100
+    # 4. Apply Weights to calculate the Final Score (0 to 1), scaled to 0-100 for readability.
+    # Only the final score is written back to the frame; the normalized terms stay as arrays.
+    df['Green_Finance_Score'] = (
+        normalized_esg * ESG_SCORING_WEIGHTS['ESG_Score_0_100'] +
+        normalized_gov * ESG_SCORING_WEIGHTS['Governance_Risk_1_5'] +
+        normalized_emission * ESG_SCORING_WEIGHTS['Emissions_Intensity_tCO2e_per_M_Rev']
+    ) * 100
     
     # Sort by the final score (highest score = best alignment)
-    df_scores.sort_values(by='Green_Finance_Score', ascending=False, inplace=True)
+    df.sort_values(by='Green_Finance_Score', ascending=False, inplace=True)
 
-    return df_scores
+    return df
 
 def summarize_portfolio(df_scored):
     """Analyzes and summarizes the portfolio's exposure across different risk tiers,
     returning both the DataFrame summary and the Markdown formatted text."""
     
-    # Define Risk Tiers based on the Green Finance Score (0-100)
-    def assign_tier(score):
-        if score >= 80:
-            return 'A: Leader (Low Risk)'
-        elif score >= 60:
-            return 'B: Aligned (Moderate Risk)'
-        elif score >= 40:
-            return 'C: Watchlist (High Risk)'
-        else:
-            return 'D: Divestment (Very High Risk)'
-            
-    df_scored['Risk_Tier'] = df_scored['Green_Finance_Score'].apply(assign_tier)
+    # Define fixed order for tiers in the output table
+    tier_order = ['A: Leader (Low Risk)', 'B: Aligned (Moderate Risk)', 'C: Watchlist (High Risk)', 'D: Divestment (Very High Risk)']
+
+    # Define Risk Tiers based on the Green Finance Score (0-100):
+    # >= 80 -> A, >= 60 -> B, >= 40 -> C, otherwise D (bins are closed on the left)
+    df_scored['Risk_Tier'] = pd.cut(
+        df_scored['Green_Finance_Score'],
+        bins=[-np.inf, 40, 60, 80, np.inf],
+        labels=tier_order[::-1],
+        right=False
+    )
     
     # Calculate key summary metrics
     total_exposure = df_scored['Outstanding_Amount_Mn'].sum()
     
-    # Group and aggregate data
-    summary = df_scored.groupby('Risk_Tier').agg(
+    # Group and aggregate data (only tiers present in the portfolio)
+    summary = df_scored.groupby('Risk_Tier', observed=True).agg(
         Total_Exposure=('Outstanding_Amount_Mn', 'sum'),
         Count=('Loan_ID', 'count'),
         Avg_Score=('Green_Finance_Score', 'mean')
@@ -133,8 +135,6 @@ def summarize_portfolio(df_scored):
 
     summary['Exposure_Percentage'] = (summary['Total_Exposure'] / total_exposure) * 100
     
-    # Define fixed order for tiers in the output table
-    tier_order = ['A: Leader (Low Risk)', 'B: Aligned (Moderate Risk)', 'C: Watchlist (High Risk)', 'D: Divestment (Very High Risk)']
     summary['Risk_Tier'] = pd.Categorical(summary['Risk_Tier'], categories=tier_order, ordered=True)
     summary.sort_values('Risk_Tier', inplace=True)
     
@@ -152,6 +152,10 @@ def summarize_portfolio(df_scored):
 
 def plot_exposure_by_risk_tier(summary_df, save_filepath):
     """Creates a visualization of the total loan exposure across the defined risk tiers and saves it."""
+    # Imported lazily so headless pipeline runs without --plot never load matplotlib
+    import matplotlib
+    matplotlib.use('Agg') # Render straight to file, no GUI backend probing
+    import matplotlib.pyplot as plt
     
     # Ensure tiers are plotted in the correct (score-based) order
     summary_df = summary_df.sort_values(by='Avg_Score', ascending=True) 
@@ -184,10 +188,10 @@ def plot_exposure_by_risk_tier(summary_df, save_filepath):
     plt.grid(axis='y', linestyle='--', alpha=0.7)
     
     # Add labels for exposure percentage
-    for bar in bars:
+    # Bars were built from the rows of summary_df, so the percentages line up by position
+    percentages = summary_df['Exposure_Percentage'].to_numpy()
+    for bar, percentage in zip(bars, percentages):
         height = bar.get_height()
-        # Find the corresponding percentage using the height (exposure amount)
-        percentage = summary_df[summary_df['Total_Exposure'] == height]['Exposure_Percentage'].iloc[0]
         
         plt.text(
             bar.get_x() + bar.get_width() / 2., 
@@ -205,8 +209,13 @@ def plot_exposure_by_risk_tier(summary_df, save_filepath):
 # --- Main Execution Block ---
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage 2: ESG Loan Risk and Allocation Analysis")
+    parser.add_argument('--plot', action='store_true',
+                        help="Also render the exposure-by-risk-tier chart as a PNG in the report directory.")
+    args = parser.parse_args()
+
     # Define the input file path
-    FILEPATH = r'D:\DS\DS25\GreenFin\GreenFin-AI\data\cleaned\portfolio_clean.csv'
+    FILEPATH = r'D:\DS\DS25\GreenFin\GreenFin-AI\data\cleaned\portfolio_clean.parquet'
     
     print("--- Stage 2: ESG Loan Risk and Allocation Analysis ---")
     
@@ -222,50 +231,57 @@ if __name__ == "__main__":
     # 3. Summarize Portfolio Exposure
     summary_results, summary_markdown = summarize_portfolio(loan_df_scored)
     
-    # 4. Plot Exposure and Save
-    plot_exposure_by_risk_tier(
-        summary_results, 
-        os.path.join(REPORT_DIR, 'exposure_by_risk_tier.png')
-    )
+    # 4. Save the plot data, and only render the plot when asked for
+    summary_filepath = os.path.join(REPORT_DIR, 'exposure_by_risk_tier.parquet')
+    summary_results.to_parquet(summary_filepath, engine='pyarrow', index=False)
+    print(f"Plot data saved to: {summary_filepath}")
+
+    if args.plot:
+        plot_exposure_by_risk_tier(
+            summary_results, 
+            os.path.join(REPORT_DIR, 'exposure_by_risk_tier.png')
+        )
     
     # 5. Prepare and Output Top/Worst Performing Loans
     
-    report_content = summary_markdown
+    report_parts = [summary_markdown]
+    report_columns = ['Borrower_Name', 'Sector', 'Outstanding_Amount_Mn', 'Green_Finance_Score', 'Risk_Tier']
     
     # TOP 5 LOANS
     top_loans = loan_df_scored[loan_df_scored['Risk_Tier'].str.startswith('A')].head(5)
     
-    report_content += "\n" + "="*80 + "\n"
-    report_content += "TOP 5 LOANS - BEST GREEN FINANCE ALIGNMENT (Score >= 80)\n"
-    
+    report_parts.append("\n" + "="*80 + "\n")
+    top_loans_header = "TOP 5 LOANS - BEST GREEN FINANCE ALIGNMENT (Score >= 80)\n"
     if top_loans.empty:
         top_loans = loan_df_scored.head(5)
-        report_content += "(No A-rated loans found, showing top 5 overall):\n"
+        top_loans_header += "(No A-rated loans found, showing top 5 overall):\n"
     
-    top_loans_markdown = top_loans[['Borrower_Name', 'Sector', 'Outstanding_Amount_Mn', 'Green_Finance_Score', 'Risk_Tier']].to_markdown(index=False, floatfmt=".2f")
-    report_content += top_loans_markdown
-    print(report_content.splitlines()[-len(top_loans_markdown.splitlines()):-1][0]) # Print header for top loans
+    top_loans_markdown = top_loans[report_columns].to_markdown(index=False, floatfmt=".2f")
+    report_parts.append(top_loans_header)
+    report_parts.append(top_loans_markdown)
+    print(top_loans_header, end='') # Print header for top loans
     print(top_loans_markdown) # Print table for top loans
 
 
     # BOTTOM 5 LOANS
     bottom_loans = loan_df_scored[loan_df_scored['Risk_Tier'].str.startswith('D')].tail(5) 
     
-    report_content += "\n" + "-"*80 + "\n"
-    report_content += "BOTTOM 5 LOANS - WORST GREEN FINANCE ALIGNMENT (Candidates for Divestment)\n"
-
+    report_parts.append("\n" + "-"*80 + "\n")
+    bottom_loans_header = "BOTTOM 5 LOANS - WORST GREEN FINANCE ALIGNMENT (Candidates for Divestment)\n"
     if bottom_loans.empty:
         bottom_loans = loan_df_scored.tail(5)
-        report_content += "(No D-rated loans found, showing bottom 5 overall):\n"
+        bottom_loans_header += "(No D-rated loans found, showing bottom 5 overall):\n"
         
-    bottom_loans_markdown = bottom_loans[['Borrower_Name', 'Sector', 'Outstanding_Amount_Mn', 'Green_Finance_Score', 'Risk_Tier']].to_markdown(index=False, floatfmt=".2f")
-    report_content += bottom_loans_markdown
-    print(report_content.splitlines()[-len(bottom_loans_markdown.splitlines()):-1][0]) # Print header for bottom loans
+    bottom_loans_markdown = bottom_loans[report_columns].to_markdown(index=False, floatfmt=".2f")
+    report_parts.append(bottom_loans_header)
+    report_parts.append(bottom_loans_markdown)
+    print(bottom_loans_header, end='') # Print header for bottom loans
     print(bottom_loans_markdown) # Print table for bottom loans
     
-    report_content += "\n" + "="*80 + "\n"
+    report_parts.append("\n" + "="*80 + "\n")
+    report_content = ''.join(report_parts)
 
     # 6. Save the final text report
     save_report_content('esg_analysis_report.md', report_content)
     
-    print("\n*** ESG Analysis Complete. All results and the visualization are saved in the 'report' directory. ***")
\ No newline at end of file
+    print("\n*** ESG Analysis Complete. All results (and the visualization, with --plot) are saved in the 'report' directory. ***")
\ No newline at end of file
@@ -1,13 +1,22 @@
 import pandas as pd
 import numpy as np
 import scipy.optimize as sco
-import matplotlib.pyplot as plt
+import scipy.linalg as sla
+from sklearn.covariance import LedoitWolf
+from numba import njit
 import os
 
 # Configuration
-DATA_PATH = os.path.join(os.path.dirname(__file__), '../data/cleaned/portfolio_clean.csv')
+DATA_PATH = os.path.join(os.path.dirname(__file__), '../data/cleaned/portfolio_clean.parquet')
+# Only these columns of the cleaned portfolio are used by the optimizer
+OPTIMIZATION_COLUMNS = ['Loan_ID', 'ESG_Score_0_100']
+# GFS Tier cut-offs on the ESG Score: < 40 -> D, < 60 -> C, < 80 -> B, otherwise A
+TIER_THRESHOLDS = [40, 60, 80]
+TIER_LABELS = ['D', 'C', 'B', 'A']
 RISK_FREE_RATE = 0.03
 TRADING_DAYS = 252
+# Iteration cap for the SLSQP fallback of the max-Sharpe optimizer
+SLSQP_MAX_ITER = 200
 
 def load_data(filepath):
     """Loads the cleaned portfolio data."""
@@ -23,61 +32,140 @@ def load_data(filepath):
         }
         df = pd.DataFrame(data)
         return df
-    return pd.read_csv(filepath)
-
-def assign_tier(esg_score):
-    """Assigns GFS Tier based on ESG Score."""
-    if esg_score >= 80:
-        return 'A'
-    elif esg_score >= 60:
-        return 'B'
-    elif esg_score >= 40:
-        return 'C'
-    else:
-        return 'D'
+    return pd.read_parquet(filepath, columns=OPTIMIZATION_COLUMNS, engine='pyarrow')
 
 def simulate_historical_returns(df, days=TRADING_DAYS*2):
     """
     Simulates historical returns for the assets.
     Assumption: Higher ESG Score -> Lower Volatility, Slightly lower but more stable returns.
     Lower ESG Score -> Higher Volatility, Higher Risk Premium (but subject to shocks).
+    Returns a (days, n_assets) float32 array and the Loan_ID index of its columns.
     """
-    np.random.seed(42)
+    rng = np.random.default_rng(42)
     n_assets = len(df)
     
     # Base params
-    means = np.random.normal(0.08, 0.05, n_assets) / TRADING_DAYS
+    means = rng.normal(0.08, 0.05, n_assets) / TRADING_DAYS
     # Adjust volatility based on ESG score (Inverse relationship)
     # Score 100 -> low vol, Score 0 -> high vol
-    vol_scale = (1 - df['ESG_Score_0_100'] / 150.0) # 0.33 to 1.0 multiplier
-    vols = np.random.uniform(0.15, 0.40, n_assets) * vol_scale / np.sqrt(TRADING_DAYS)
+    vol_scale = (1 - df['ESG_Score_0_100'].to_numpy() / 150.0) # 0.33 to 1.0 multiplier
+    vols = rng.uniform(0.15, 0.40, n_assets) * vol_scale / np.sqrt(TRADING_DAYS)
     
-    returns = np.random.normal(loc=means, scale=vols, size=(days, n_assets))
-    return pd.DataFrame(returns, columns=df['Loan_ID'])
+    # Scale standard normals in place instead of broadcasting loc/scale into new buffers
+    returns = rng.standard_normal((days, n_assets), dtype=np.float32)
+    returns *= vols.astype(np.float32)
+    returns += means.astype(np.float32)
+    return returns, pd.Index(df['Loan_ID'])
 
-def portfolio_performance(weights, mean_returns, cov_matrix):
-    """Calculates portfolio return and volatility."""
-    returns = np.sum(mean_returns * weights) * TRADING_DAYS
-    std = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights))) * np.sqrt(TRADING_DAYS)
+def annualize(mean_returns, cov_matrix):
+    """Converts daily mean returns and covariance to annualized, contiguous float64 arrays."""
+    mu_ann = np.ascontiguousarray(np.asarray(mean_returns, dtype=np.float64) * TRADING_DAYS)
+    cov_ann = np.ascontiguousarray(np.asarray(cov_matrix, dtype=np.float64) * TRADING_DAYS)
+    return mu_ann, cov_ann
+
+@njit(cache=True, fastmath=True)
+def portfolio_performance(weights, mu_ann, cov_ann):
+    """Calculates annualized portfolio return and volatility."""
+    returns = mu_ann @ weights
+    std = np.sqrt(weights @ cov_ann @ weights)
     return returns, std
 
-def neg_sharpe_ratio(weights, mean_returns, cov_matrix, risk_free_rate):
+@njit(cache=True, fastmath=True)
+def neg_sharpe_ratio(weights, mu_ann, cov_ann, risk_free_rate):
     """Negative Sharpe Ratio for minimization."""
-    p_ret, p_std = portfolio_performance(weights, mean_returns, cov_matrix)
+    p_ret, p_std = portfolio_performance(weights, mu_ann, cov_ann)
     return -(p_ret - risk_free_rate) / p_std
 
-def get_max_sharpe_ratio_weights(mean_returns, cov_matrix):
-    """Optimizes weights to maximize Sharpe Ratio."""
-    num_assets = len(mean_returns)
-    args = (mean_returns, cov_matrix, RISK_FREE_RATE)
-    constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
+@njit(cache=True, fastmath=True)
+def neg_sharpe_ratio_grad(weights, mu_ann, cov_ann, risk_free_rate):
+    """Analytic gradient of the Negative Sharpe Ratio with respect to the weights."""
+    cov_w = cov_ann @ weights
+    p_ret = mu_ann @ weights
+    p_std = np.sqrt(weights @ cov_w)
+    return -mu_ann / p_std + (p_ret - risk_free_rate) * cov_w / p_std**3
+
+# Compile the optimizer kernels once at import with a tiny warm-up call,
+# so the first SLSQP iteration is not charged the JIT cost
+_warmup_weights = np.full(2, 0.5)
+_warmup_mu, _warmup_cov = np.array([0.05, 0.1]), np.eye(2)
+neg_sharpe_ratio(_warmup_weights, _warmup_mu, _warmup_cov, RISK_FREE_RATE)
+neg_sharpe_ratio_grad(_warmup_weights, _warmup_mu, _warmup_cov, RISK_FREE_RATE)
+
+def tangency_weights(mu_ann, cov_ann):
+    """
+    Closed-form tangency portfolio, cov^-1 (mu - rf), clipped to long-only and
+    normalized to sum to 1. Used as the starting point for the optimizer;
+    falls back to equal weights when no asset has a positive allocation.
+    """
+    num_assets = len(mu_ann)
+    weights = np.linalg.lstsq(cov_ann, mu_ann - RISK_FREE_RATE, rcond=None)[0]
+    weights = np.clip(weights, 0.0, None)
+    if weights.sum() <= 0:
+        return np.full(num_assets, 1. / num_assets)
+    return weights / weights.sum()
+
+def long_only_tangency_qp(mu_ann, cov_ann):
+    """
+    Solves the long-only max-Sharpe problem exactly as a convex QP.
+    With y = w / k (Schaible transform) it becomes: minimize y' cov y subject to
+    (mu - rf)' y >= 1, y >= 0, and w = y / sum(y). Substituting x = L' y (cov = L L')
+    turns this into a least-distance problem, solved with NNLS (Lawson-Hanson).
+    Returns the weights, or None when no asset earns more than the risk-free rate.
+    """
+    excess_returns = mu_ann - RISK_FREE_RATE
+    if not (excess_returns > 0).any():
+        return None
+    try:
+        chol = np.linalg.cholesky(cov_ann)
+    except np.linalg.LinAlgError:
+        # Singular covariance (more assets than observations): regularize the diagonal slightly
+        print("Warning: covariance matrix is not positive definite; adding a small diagonal jitter.")
+        jitter = 1e-8 * np.mean(np.diag(cov_ann))
+        chol = np.linalg.cholesky(cov_ann + jitter * np.eye(len(cov_ann)))
+    # y = inv_chol_t @ x, so the constraints on y are G x >= h
+    inv_chol_t = sla.solve_triangular(chol, np.eye(len(mu_ann)), lower=True).T
+    G = np.vstack([inv_chol_t, excess_returns @ inv_chol_t])
+    h = np.zeros(G.shape[0])
+    h[-1] = 1.0
+    E = np.vstack([G.T, h])
+    f = np.zeros(E.shape[0])
+    f[-1] = 1.0
+    u, _ = sco.nnls(E, f, maxiter=50 * E.shape[1])
+    residual = E @ u - f
+    if abs(residual[-1]) < 1e-12:
+        return None
+    y = np.clip(inv_chol_t @ (-residual[:-1] / residual[-1]), 0.0, None)
+    if y.sum() <= 0:
+        return None
+    return y / y.sum()
+
+def get_max_sharpe_ratio_weights(mu_ann, cov_ann):
+    """
+    Optimizes weights to maximize Sharpe Ratio (inputs as returned by `annualize`).
+    Solves the long-only tangency QP directly; SLSQP is only used as a fallback.
+    """
+    args = (mu_ann, cov_ann, RISK_FREE_RATE)
+    try:
+        qp_weights = long_only_tangency_qp(mu_ann, cov_ann)
+    except (np.linalg.LinAlgError, RuntimeError) as e:
+        print(f"Warning: tangency QP failed ({e}). Falling back to SLSQP.")
+        qp_weights = None
+    if qp_weights is not None:
+        return sco.OptimizeResult(x=qp_weights, fun=neg_sharpe_ratio(qp_weights, *args),
+                                  success=True, message='Solved long-only tangency QP')
+
+    num_assets = len(mu_ann)
+    constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones_like(x)})
     bound = (0.0, 1.0)
     bounds = tuple(bound for asset in range(num_assets))
     
-    initial_weights = num_assets * [1. / num_assets,]
+    initial_weights = tangency_weights(mu_ann, cov_ann)
     
-    result = sco.minimize(neg_sharpe_ratio, initial_weights, args=args,
-                        method='SLSQP', bounds=bounds, constraints=constraints)
+    result = sco.minimize(neg_sharpe_ratio, initial_weights, args=args, jac=neg_sharpe_ratio_grad,
+                        method='SLSQP', bounds=bounds, constraints=constraints,
+                        options={'maxiter': SLSQP_MAX_ITER, 'ftol': 1e-9})
+    if not result.success:
+        print(f"Warning: SLSQP did not converge ({result.message}); using its last iterate.")
     
     return result
 
@@ -86,37 +174,41 @@ def run_optimization():
     df = load_data(DATA_PATH)
     
     # 1. Categorization
-    df['Tier'] = df['ESG_Score_0_100'].apply(assign_tier)
+    tier_codes = np.searchsorted(TIER_THRESHOLDS, df['ESG_Score_0_100'].to_numpy(), side='right')
+    df['Tier'] = pd.Categorical.from_codes(tier_codes, categories=TIER_LABELS)
     print("Portfolio Categorization Summary:")
-    print(df['Tier'].value_counts().sort_index())
+    print(df['Tier'].value_counts().sort_index(ascending=False))
     
     # 2. Simulate Market Data (since we don't have raw price history)
     print("\nSimulating historical asset returns based on ESG profiles...")
-    returns_df = simulate_historical_returns(df)
-    mean_returns = returns_df.mean()
-    cov_matrix = returns_df.cov()
+    returns, _ = simulate_historical_returns(df)
+    mean_returns = returns.mean(axis=0, dtype=np.float64)
+    # Ledoit-Wolf shrinkage keeps the covariance well conditioned when assets outnumber observations
+    cov_matrix = LedoitWolf().fit(returns).covariance_
+    mu_ann, cov_ann = annualize(mean_returns, cov_matrix)
     
     # 3. Optimization: Scenario A (Legacy Portfolio - All Assets)
     print("\nOptimizing Legacy Portfolio (All Assets)...")
-    result_legacy = get_max_sharpe_ratio_weights(mean_returns, cov_matrix)
+    result_legacy = get_max_sharpe_ratio_weights(mu_ann, cov_ann)
     weights_legacy = result_legacy.x
-    ret_legacy, vol_legacy = portfolio_performance(weights_legacy, mean_returns, cov_matrix)
+    ret_legacy, vol_legacy = portfolio_performance(weights_legacy, mu_ann, cov_ann)
     sharpe_legacy = (ret_legacy - RISK_FREE_RATE) / vol_legacy
     print(f"Legacy Sharpe Ratio: {sharpe_legacy:.4f}")
     print(f"Legacy Volatility: {vol_legacy:.4f}")
     
     # 4. Optimization: Scenario B (Decoupled Portfolio - Ex-Tier D)
     print("\nOptimizing Decoupled Portfolio (Ex-Tier D)...")
-    # Filter out Tier D columns
-    non_d_ids = df[df['Tier'] != 'D']['Loan_ID']
-    returns_df_decoupled = returns_df[non_d_ids]
+    # Filter out Tier D columns (returns columns are in the same order as the rows of df)
+    non_d_mask = (df['Tier'] != 'D').to_numpy()
+    returns_decoupled = returns[:, non_d_mask]
     
-    mean_returns_dec = returns_df_decoupled.mean()
-    cov_matrix_dec = returns_df_decoupled.cov()
+    mean_returns_dec = returns_decoupled.mean(axis=0, dtype=np.float64)
+    cov_matrix_dec = LedoitWolf().fit(returns_decoupled).covariance_
+    mu_ann_dec, cov_ann_dec = annualize(mean_returns_dec, cov_matrix_dec)
     
-    result_dec = get_max_sharpe_ratio_weights(mean_returns_dec, cov_matrix_dec)
+    result_dec = get_max_sharpe_ratio_weights(mu_ann_dec, cov_ann_dec)
     weights_dec = result_dec.x
-    ret_dec, vol_dec = portfolio_performance(weights_dec, mean_returns_dec, cov_matrix_dec)
+    ret_dec, vol_dec = portfolio_performance(weights_dec, mu_ann_dec, cov_ann_dec)
     sharpe_dec = (ret_dec - RISK_FREE_RATE) / vol_dec
     print(f"Decoupled Sharpe Ratio: {sharpe_dec:.4f}")
     print(f"Decoupled Volatility: {vol_dec:.4f}")